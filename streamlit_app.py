@@ -1,10 +1,11 @@
 import streamlit as st
 import pandas as pd
-import plotly.express as px
 import plotly.graph_objects as go
 import numpy as np
-from datetime import datetime
-import base64
+import os
+import tempfile
+import pyarrow as pa
+import pyarrow.csv as pacsv
 
 # App-Konfiguration
 st.set_page_config(
@@ -23,113 +24,155 @@ COUNTRIES = {
     'Niederlande': 'nl'
 }
 
+# Farbpalette für den Kurvenvergleich (entspricht plotly.express Set1)
+SET1 = ['#e41a1c', '#377eb8', '#4daf4a', '#984ea3', '#ff7f00', '#ffff33', '#a65628', '#f781bf', '#999999']
+
+def read_excel_data(file_path):
+    """Liest die Excel-Datei ein und bereinigt Spalten und Zeitachse"""
+    # Excel-Datei einlesen (calamine-Engine ist deutlich schneller als openpyxl)
+    df = pd.read_excel(file_path, sheet_name=0, engine="calamine")
+    
+    # Spaltennamen bereinigen - Leerzeichen entfernen
+    df.columns = [col.replace(' ', '') for col in df.columns]
+
+    # Alle numerischen Spalten auf 3 Nachkommastellen runden
+    # (in einem NumPy-Block statt spaltenweise, ursprüngliche Spaltenreihenfolge bleibt erhalten)
+    numeric_cols = df.select_dtypes(include=[np.number]).columns
+    rounded = pd.DataFrame(np.round(df[numeric_cols].to_numpy(), 3), columns=numeric_cols, index=df.index)
+    df = pd.concat([df.drop(columns=numeric_cols), rounded], axis=1)[df.columns]
+    
+    # Zeit-Spalte verarbeiten
+    if 'Time' in df.columns:
+        df['Time'] = pd.to_datetime(df['Time'])
+    elif df.columns[0] not in ['pi_1q', 'pi_2q']:
+        df = df.rename(columns={df.columns[0]: 'Time'})
+        df['Time'] = pd.to_datetime(df['Time'])
+    
+    # explizit nach datum (aufsteigend) sortieren
+    df = df.sort_values('Time').reset_index(drop=True)
+    
+    return df
+
+def write_parquet_cache(df, pq_path):
+    """Legt die aufbereiteten Daten atomar als Parquet ab (Temp-Datei + os.replace)"""
+    # Der Cache ist optional: ein schreibgeschütztes Dateisystem oder nicht nach Arrow
+    # konvertierbare Spalten sind kein Fehler, dann wird beim nächsten Mal erneut Excel gelesen
+    try:
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(pq_path), suffix='.parquet.tmp')
+    except OSError:
+        return
+    
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            df.to_parquet(f, compression="zstd", index=False)
+        os.replace(tmp_path, pq_path)
+    except Exception:
+        pass
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
 @st.cache_data
-def load_data(country_code):
-    """Lädt und bereitet die Daten für das gewählte Land vor"""
+def read_data(country_code):
+    """Lädt und bereitet die Daten für das gewählte Land vor, liefert (Daten, Fehlermeldung)"""
     try:
-        # Pfad zur Excel-Datei
+        # Pfad zur Excel-Datei und zum Parquet-Cache daneben
         file_path = f"data/{country_code}/FittedTermStructure.xlsx"
+        pq_path = f"data/{country_code}/FittedTermStructure.parquet"
         
-        # Excel-Datei einlesen
-        df = pd.read_excel(file_path)
+        # Parquet-Cache verwenden, solange er neuer als die Excel-Datei ist
+        df = None
+        if os.path.exists(pq_path) and os.path.getmtime(pq_path) >= os.path.getmtime(file_path):
+            try:
+                df = pd.read_parquet(pq_path)
+            except (OSError, ValueError):
+                # Defekter Cache - unten neu aus der Excel-Datei aufbauen
+                df = None
         
-        # Spaltennamen bereinigen - Leerzeichen entfernen
-        df.columns = [col.replace(' ', '') for col in df.columns]
-
-        # Alle numerischen Spalten auf 3 Nachkommastellen runden
-        numeric_cols = df.select_dtypes(include=[np.number]).columns
-        df[numeric_cols] = df[numeric_cols].round(3)
-        
-        # Zeit-Spalte verarbeiten
-        if 'Time' in df.columns:
-            df['Time'] = pd.to_datetime(df['Time'])
-        elif df.columns[0] not in ['pi_1q', 'pi_2q']:
-            df = df.rename(columns={df.columns[0]: 'Time'})
-            df['Time'] = pd.to_datetime(df['Time'])
+        if df is None:
+            df = read_excel_data(file_path)
+            write_parquet_cache(df, pq_path)
         
-        # explizit nach datum (aufsteigend) sortieren
-        df = df.sort_values('Time').reset_index(drop=True)
-        
-        return df
+        return df, None
         
     except FileNotFoundError:
-        st.error(f"Datei nicht gefunden: {file_path}")
-        st.info("Verwende Beispiel-Daten für Demo-Zwecke")
-        return load_sample_data()
+        return load_sample_data(), f"Datei nicht gefunden: {file_path}"
     except Exception as e:
-        st.error(f"Fehler beim Laden der Daten: {str(e)}")
-        st.info("Verwende Beispiel-Daten für Demo-Zwecke")
-        return load_sample_data()
+        return load_sample_data(), f"Fehler beim Laden der Daten: {str(e)}"
+
+def load_data(country_code):
+    """Liefert die (gecachten) Daten für das gewählte Land"""
+    # Hinweise zu fehlenden Daten zeigt main() einmalig an - st.error in gecachten
+    # Funktionen würde in jeder darauf aufbauenden gecachten Funktion erneut erscheinen
+    return read_data(country_code)[0]
 
 def load_sample_data():
     """Lädt Beispiel-Daten falls echte Daten nicht verfügbar"""
-    quarters = []
-    
-    for year in range(1989, 2026):
-        for quarter in [3, 6, 9, 12]:
-            if year == 1989 and quarter < 12:
-                continue
-            month = quarter if quarter != 12 else 12
-            day = 31 if quarter == 12 else 30
-            if quarter == 6:
-                day = 30
-            elif quarter == 3:
-                day = 31
-            elif quarter == 9:
-                day = 30
-            
-            date_str = f"{day:02d}.{month:02d}.{year}"
-            quarters.append(date_str)
+    # Quartalsenden von 1989Q4 bis 2025Q4
+    times = pd.date_range("1989-12-31", "2025-12-31", freq="QE")
+    n_quarters = len(times)
     
     np.random.seed(42)
-    n_quarters = len(quarters)
-    data = {'Time': quarters}
-    
-    for q in range(1, 41):
-        base_trend = 2.0 + 0.5 * np.sin(np.linspace(0, 4*np.pi, n_quarters))
-        horizon_adjustment = (q - 1) * 0.01
-        noise = np.random.normal(0, 0.2, n_quarters)
-        values = base_trend + horizon_adjustment + noise
-        values = np.maximum(values, 0.5)
-        data[f'pi_{q}q'] = values
-    
-    df = pd.DataFrame(data)
-    df['Time'] = pd.to_datetime(df['Time'], format='%d.%m.%Y')
+    base_trend = 2.0 + 0.5 * np.sin(np.linspace(0, 4*np.pi, n_quarters))
+    horizon_adjustment = np.arange(40) * 0.01
+    # Rauschen horizontweise ziehen, damit die Beispiel-Daten unverändert bleiben
+    noise = np.random.normal(0, 0.2, (40, n_quarters)).T
+    values = base_trend[:, None] + horizon_adjustment[None, :] + noise
+    np.maximum(values, 0.5, out=values)
+    
+    df = pd.concat([
+        pd.DataFrame({'Time': times}),
+        pd.DataFrame(values, columns=[f'pi_{q}q' for q in range(1, 41)])
+    ], axis=1)
     return df
 
-def format_quarter(date):
-    """Formatiert Datum als YYYYQX"""
-    year = date.year
-    month = date.month
-    if month in [1, 2, 3]:
-        quarter = 1
-    elif month in [4, 5, 6]:
-        quarter = 2
-    elif month in [7, 8, 9]:
-        quarter = 3
-    else:
-        quarter = 4
-    return f"{year}Q{quarter}"
+def format_quarters(times):
+    """Formatiert eine Datums-Spalte vektorisiert als YYYYQX"""
+    return times.dt.year.astype(str) + 'Q' + times.dt.quarter.astype(str)
 
-def get_global_y_range(df):
+@st.cache_data
+def get_curve_block(country_code):
+    """Horizont-Block als Matrix samt Labels und Index-Zuordnungen für direkte Zeilenzugriffe"""
+    df = load_data(country_code)
+    horizon_cols = [col for col in df.columns if col.startswith('pi_')]
+    quarter_labels = format_quarters(df['Time']).tolist()
+    
+    # Bei doppelten Quartalen (z.B. Spanien) gewinnt wie bisher bei list.index die erste Zeile
+    label_to_idx = {}
+    for i, label in enumerate(quarter_labels):
+        label_to_idx.setdefault(label, i)
+    
+    return {
+        'horizon_cols': horizon_cols,
+        'horizon_values': np.array([int(col[3:-1]) for col in horizon_cols], dtype=np.int16),
+        # Zeilen = Zeitpunkte, Spalten = Horizonte
+        'pi_matrix': np.ascontiguousarray(df[horizon_cols].to_numpy(dtype=np.float64)),
+        'quarter_labels': quarter_labels,
+        'label_to_idx': label_to_idx,
+        # Fingerabdruck der Daten als Teil der Cache-Schlüssel der Charts
+        'data_version': int(pd.util.hash_pandas_object(df, index=False).sum())
+    }
+
+def labels_to_positions(block, quarter_labels):
+    """Zeilenpositionen zu Quartals-Labels, doppelte Auswahl bzw. doppelte Quartale nur einmal"""
+    return list(dict.fromkeys(block['label_to_idx'][label] for label in quarter_labels))
+
+@st.cache_data
+def get_global_y_range(country_code):
     """Berechnet globale Min/Max-Werte für einheitliche Skalierung"""
-    horizons_cols = [col for col in df.columns if col.startswith('pi_')]
-    all_values = []
-    for col in horizons_cols:
-        all_values.extend(df[col].dropna().tolist())
-    
-    if all_values:
-        global_min = min(all_values)
-        global_max = max(all_values)
-        return [global_min - 0.2, global_max + 0.2]
-    else:
+    pi_matrix = get_curve_block(country_code)['pi_matrix']
+    
+    if np.isnan(pi_matrix).all():
         return [0, 5]
+    return [float(np.nanmin(pi_matrix)) - 0.2, float(np.nanmax(pi_matrix)) + 0.2]
 
-def create_timeseries_overview_chart(df):
+@st.cache_resource(max_entries=32)
+def create_timeseries_overview_chart(country_code, data_version):
     """Erstellt Zeitreihen-Plot für ausgewählte Inflationserwartungs-Horizonte"""
+    df = load_data(country_code)
     fig = go.Figure()
     
-    y_range = get_global_y_range(df)
+    y_range = get_global_y_range(country_code)
     
     # Horizonte ohne Leerzeichen (da diese beim Laden entfernt wurden)
     selected_horizons = [
@@ -146,11 +189,12 @@ def create_timeseries_overview_chart(df):
     ('pi_40q', '40 Quartale', '#FF0000')  # Rot
     ]
     
-    available_cols = [col for col in df.columns if col.startswith('pi_')]
+    available_cols = get_curve_block(country_code)['horizon_cols']
     
     for horizon_col, label, color in selected_horizons:
         if horizon_col in available_cols:
-            fig.add_trace(go.Scatter(
+            # WebGL-Rendering für die Zeitreihen (schneller bei Zoom/Hover)
+            fig.add_trace(go.Scattergl(
                 x=df['Time'],
                 y=df[horizon_col],
                 mode='lines',
@@ -177,106 +221,97 @@ def create_timeseries_overview_chart(df):
     
     return fig
 
-def prepare_curve_data(df):
-    """Bereitet Daten für Strukturkurven vor"""
-    horizons = [col for col in df.columns if col.startswith('pi_')]
-    horizon_values = [int(col.split('_')[1][:-1]) for col in horizons]
-    
-    curves_data = []
-    for idx, row in df.iterrows():
-        curve_data = {
-            'date': row['Time'],
-            'quarter_label': format_quarter(row['Time']),
-            'horizons': horizon_values,
-            'values': [row[col] for col in horizons]
-        }
-        curves_data.append(curve_data)
-    
-    return curves_data
+def get_chart_layout(country_code, kind, use_fixed_scale):
+    """Gemeinsame Layout-Einstellungen für Vergleichs- ('compare') und Evolution-Chart ('evolution')"""
+    layout_kwargs = {
+        'xaxis_title': "Horizont (Quartale)",
+        'yaxis_title': "Inflationserwartungen (% p.a.)",
+        'height': 500,
+        'hovermode': 'x unified' if kind == 'compare' else 'x'
+    }
+    if kind == 'compare':
+        layout_kwargs['title'] = "Vergleich der Inflationserwartungen-Strukturkurven"
+    
+    if use_fixed_scale:
+        layout_kwargs['yaxis'] = dict(range=get_global_y_range(country_code))
+    
+    return layout_kwargs
 
-def create_comparison_chart(df, selected_dates, use_fixed_scale=True):
+@st.cache_resource(max_entries=32)
+def create_comparison_chart(country_code, data_version, selected_labels, use_fixed_scale=True):
     """Erstellt Vergleichschart für mehrere Zeitpunkte"""
+    block = get_curve_block(country_code)
     fig = go.Figure()
     
-    horizons = [col for col in df.columns if col.startswith('pi_')]
-    horizon_values = [int(col.split('_')[1][:-1]) for col in horizons]
+    horizon_values = block['horizon_values']
     
-    colors = px.colors.qualitative.Set1
+    # Alle ausgewählten Zeilen in einem Zugriff holen
+    positions = labels_to_positions(block, selected_labels)
+    rows = block['pi_matrix'][positions]
+    quarter_labels = [block['quarter_labels'][pos] for pos in positions]
     
-    for i, date in enumerate(selected_dates):
-        row = df[df['Time'] == date].iloc[0]
-        values = [row[col] for col in horizons]
-        quarter_label = format_quarter(date)
-        
+    for i, (row_values, quarter_label) in enumerate(zip(rows, quarter_labels)):
         fig.add_trace(go.Scatter(
             x=horizon_values,
-            y=values,
+            y=row_values,
             mode='lines+markers',
             name=quarter_label,
-            line=dict(color=colors[i % len(colors)], width=2),
+            line=dict(color=SET1[i % len(SET1)], width=2),
             marker=dict(size=6)
         ))
     
-    layout_kwargs = {
-        'title': "Vergleich der Inflationserwartungen-Strukturkurven",
-        'xaxis_title': "Horizont (Quartale)",
-        'yaxis_title': "Inflationserwartungen (% p.a.)",
-        'hovermode': 'x unified',
-        'height': 500
-    }
-    
-    if use_fixed_scale:
-        layout_kwargs['yaxis'] = dict(range=get_global_y_range(df))
-    
-    fig.update_layout(**layout_kwargs)
+    fig.update_layout(**get_chart_layout(country_code, 'compare', use_fixed_scale))
     return fig
 
-def create_evolution_chart(curves_data, selected_idx, df, use_fixed_scale=True):
+@st.cache_resource(max_entries=32)
+def create_evolution_chart(country_code, data_version, quarter_label, use_fixed_scale=True):
     """Evolution-Chart mit einer Strukturkurve"""
+    block = get_curve_block(country_code)
     fig = go.Figure()
     
-    current_curve = curves_data[selected_idx]
+    selected_idx = block['label_to_idx'][quarter_label]
     fig.add_trace(
         go.Scatter(
-            x=current_curve['horizons'],
-            y=current_curve['values'],
+            x=block['horizon_values'],
+            y=block['pi_matrix'][selected_idx],
             mode='lines+markers',
-            name=f"Strukturkurve {current_curve['quarter_label']}",
+            name=f"Strukturkurve {quarter_label}",
             line=dict(color='darkblue', width=3),
             marker=dict(size=8, color='darkblue')
         )
     )
     
-    layout_kwargs = {
-        'title': f"Strukturkurve - {current_curve['quarter_label']}",
-        'xaxis_title': "Horizont (Quartale)",
-        'yaxis_title': "Inflationserwartungen (% p.a.)",
-        'height': 500,
-        'hovermode': 'x'
-    }
-    
-    if use_fixed_scale:
-        layout_kwargs['yaxis'] = dict(range=get_global_y_range(df))
-    
-    fig.update_layout(**layout_kwargs)
+    fig.update_layout(
+        title=f"Strukturkurve - {quarter_label}",
+        **get_chart_layout(country_code, 'evolution', use_fixed_scale)
+    )
     return fig
 
-def download_data_as_csv(df):
-    """Erstellt Download-Link für CSV"""
-    csv = df.to_csv(index=False)
-    b64 = base64.b64encode(csv.encode()).decode()
-    href = f'<a href="data:file/csv;base64,{b64}" download="inflationserwartungen.csv">💾 Daten als CSV herunterladen</a>'
-    return href
+def to_csv_bytes(df):
+    """Schreibt die Daten mit dem pyarrow-CSV-Writer"""
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    # Zeitpunkte wie bisher nur als Datum ausgeben (Time-Spalte kann an beliebiger Position stehen)
+    time_idx = table.schema.get_field_index('Time')
+    table = table.set_column(time_idx, 'Time', table.column(time_idx).cast(pa.date32()))
+    
+    buf = pa.BufferOutputStream()
+    pacsv.write_csv(table, buf, pacsv.WriteOptions(quoting_style='none', quoting_header='none'))
+    return buf.getvalue().to_pybytes()
 
-def download_selected_data_as_csv(df, selected_dates):
-    """Erstellt Download-Link für nur die ausgewählten Quartale"""
-    # Filtere nur die ausgewählten Zeilen
-    filtered_df = df[df['Time'].isin(selected_dates)].copy()
-    
-    csv = filtered_df.to_csv(index=False)
-    b64 = base64.b64encode(csv.encode()).decode()
-    href = f'<a href="data:file/csv;base64,{b64}" download="ausgewaehlte_quartale.csv">💾 Chart-Daten als CSV herunterladen</a>'
-    return href
+@st.cache_data
+def get_csv_data(country_code):
+    """Erstellt CSV-Daten für den Download"""
+    df = load_data(country_code)
+    return to_csv_bytes(df)
+
+@st.cache_data
+def get_selected_csv_data(country_code, selected_labels):
+    """Erstellt CSV-Daten für nur die ausgewählten Quartale"""
+    df = load_data(country_code)
+    positions = labels_to_positions(get_curve_block(country_code), selected_labels)
+    # Filtere nur die ausgewählten Zeitpunkte (inkl. aller Zeilen doppelter Quartale)
+    filtered_df = df[df['Time'].isin(df['Time'].iloc[positions])]
+    return to_csv_bytes(filtered_df)
 
 # Hauptanwendung
 def main():
@@ -295,8 +330,12 @@ def main():
     country_code = COUNTRIES[selected_country]
     
     # Daten laden
-    df = load_data(country_code)
-    curves_data = prepare_curve_data(df)
+    _, load_error = read_data(country_code)
+    if load_error:
+        st.error(load_error)
+        st.info("Verwende Beispiel-Daten für Demo-Zwecke")
+    block = get_curve_block(country_code)
+    data_version = block['data_version']
     
     # Tabs
     tab1, tab2, tab3 = st.tabs(["📈 Übersicht", "🔍 Strukturkurven Vergleich", "🎬 Evolution der Kurve"])
@@ -305,20 +344,24 @@ def main():
         st.header("Gesamtübersicht der Strukturkurve")
         
         # Chart
-        fig_timeseries = create_timeseries_overview_chart(df)
+        fig_timeseries = create_timeseries_overview_chart(country_code, data_version)
         st.plotly_chart(fig_timeseries, use_container_width=True)
         
         # Downloads UNTER dem Chart
         col1, col2, col3 = st.columns([1, 1, 1])
         with col1:
-            st.markdown(download_data_as_csv(df), unsafe_allow_html=True)
+            st.download_button(
+                "💾 Daten als CSV herunterladen",
+                data=get_csv_data(country_code),
+                file_name="inflationserwartungen.csv",
+                mime="text/csv"
+            )
         
     
     with tab2:
         st.header("Vergleich mehrerer Zeitpunkte")
         
-        quarter_options = [(row['Time'], format_quarter(row['Time'])) for _, row in df.iterrows()]
-        quarter_labels = [label for _, label in quarter_options]
+        quarter_labels = block['quarter_labels']
         
         default_selection = quarter_labels[-3:] if len(quarter_labels) >= 3 else quarter_labels
         
@@ -336,25 +379,25 @@ def main():
         )
         
         if selected_quarter_labels:
-            selected_dates = []
-            for label in selected_quarter_labels:
-                for date, qlabel in quarter_options:
-                    if qlabel == label:
-                        selected_dates.append(date)
-                        break
+            selected_labels = tuple(selected_quarter_labels)
             
-            fig1 = create_comparison_chart(df, selected_dates, use_fixed_y_axis)
+            fig1 = create_comparison_chart(country_code, data_version, selected_labels, use_fixed_y_axis)
             st.plotly_chart(fig1, use_container_width=True)
         
              # Downloads UNTER dem Chart
             col1, col2, col3 = st.columns([1, 1, 1])
             with col1:
-                st.markdown(download_selected_data_as_csv(df, selected_dates), unsafe_allow_html=True)
+                st.download_button(
+                    "💾 Chart-Daten als CSV herunterladen",
+                    data=get_selected_csv_data(country_code, selected_labels),
+                    file_name="ausgewaehlte_quartale.csv",
+                    mime="text/csv"
+                )
     
     with tab3:
         st.header("Evolution der Strukturkurve")
         
-        quarter_labels_dropdown = [curves_data[i]['quarter_label'] for i in range(len(curves_data))]
+        quarter_labels_dropdown = block['quarter_labels']
         
         #selected_quarter_label = st.selectbox(
         #    "Wählen Sie ein Quartal:",
@@ -371,7 +414,7 @@ def main():
         )
 
         # Index für das ausgewählte Quartal finden
-        selected_quarter_idx = quarter_labels_dropdown.index(selected_quarter_label)
+        selected_quarter_idx = block['label_to_idx'][selected_quarter_label]
         
         use_fixed_y_axis_evolution = st.checkbox(
             "Feste Y-Achse verwenden",
@@ -380,18 +423,14 @@ def main():
             help="Wenn aktiviert, wird dieselbe Y-Achsen-Skalierung wie in der Übersicht verwendet"
         )
         
-        selected_quarter_idx = quarter_labels_dropdown.index(selected_quarter_label)
-        
-        fig2 = create_evolution_chart(curves_data, selected_quarter_idx, df, use_fixed_y_axis_evolution)
+        fig2 = create_evolution_chart(country_code, data_version, selected_quarter_label, use_fixed_y_axis_evolution)
         st.plotly_chart(fig2, use_container_width=True)
         
         
         # Details zum ausgewählten Quartal - nur Metriken
         st.subheader("Details zum ausgewählten Quartal")
-        current_curve = curves_data[selected_quarter_idx]
-        
         col1, col2, col3 = st.columns(3)
-        values = current_curve['values']
+        values = block['pi_matrix'][selected_quarter_idx]
         
         with col1:
             st.metric("Kurzfristig (1Q)", f"{values[0]:.3f}%")